@@ -0,0 +1,194 @@
+"""Benchmark the directory XML source against the custom report JSON source.
+
+Usage:
+  python bench_directory.py live [repeats]
+      End to end against BambooHR: times bamboo_directory_xml and
+      bamboo_custom_report (network round-trip plus parse) and reports the
+      real response sizes. Needs BAMBOO_API_KEY and BAMBOO_COMPANY_DOMAIN.
+  python bench_directory.py synthetic [employees] [repeats]
+      Local parser cost only, on generated payloads carrying the same fields
+      in both formats. Says nothing about payload size or network time.
+"""
+
+import json
+import os
+import sys
+import time
+from xml.sax.saxutils import escape
+
+import sync
+
+# Fields the real directory XML carries that the identity parser reads.
+DIRECTORY_IDENTITY_FIELDS = [
+    "firstName",
+    "lastName",
+    "preferredName",
+    "displayName",
+    "workEmail",
+    "department",
+]
+
+
+def best_of(repeats, fn):
+    timings = []
+    result = None
+    for _ in range(max(1, repeats)):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def identity_mismatches(xml_map, report_map):
+    mismatched = []
+    for employee_id, xml_record in xml_map.items():
+        if employee_id not in report_map:
+            continue
+        expected = sync.parse_directory_identity(employee_id, xml_record)
+        if sync.parse_directory_identity(employee_id, report_map[employee_id]) != expected:
+            mismatched.append(employee_id)
+    return mismatched
+
+
+class ResponseSizes:
+    """Wraps requests.get/post to record wire and decoded byte counts per call."""
+
+    def __init__(self):
+        self.calls = []
+        self._get = sync.requests.get
+        self._post = sync.requests.post
+
+    def _track(self, resp):
+        # Non-streamed responses are already read by requests before we see them.
+        consumed = getattr(resp, "_content_consumed", False)
+        entry = {"decoded_bytes": len(resp.content or b"") if consumed else 0, "raw": resp.raw}
+        self.calls.append(entry)
+        iter_content = resp.iter_content
+
+        def counting_iter_content(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                entry["decoded_bytes"] += len(chunk)
+                yield chunk
+
+        resp.iter_content = counting_iter_content
+        return resp
+
+    def get(self, *args, **kwargs):
+        return self._track(self._get(*args, **kwargs))
+
+    def post(self, *args, **kwargs):
+        return self._track(self._post(*args, **kwargs))
+
+    def last(self):
+        entry = self.calls[-1]
+        return {"wire_bytes": entry["raw"].tell(), "decoded_bytes": entry["decoded_bytes"]}
+
+
+def run_live(repeats):
+    api_key = os.getenv("BAMBOO_API_KEY", "")
+    if not api_key or not sync.BAMBOO_COMPANY_DOMAIN:
+        raise SystemExit("live mode needs BAMBOO_API_KEY and BAMBOO_COMPANY_DOMAIN")
+
+    sizes = ResponseSizes()
+    sync.requests.get = sizes.get
+    sync.requests.post = sizes.post
+
+    xml_seconds, xml_map = best_of(repeats, lambda: sync.bamboo_directory_xml(api_key))
+    xml_sizes = sizes.last()
+    report_seconds, report_map = best_of(repeats, lambda: sync.bamboo_custom_report(api_key))
+    report_sizes = sizes.last()
+
+    mismatched = identity_mismatches(xml_map, report_map)
+    return {
+        "mode": "live",
+        "repeats": repeats,
+        "xml_employees": len(xml_map),
+        "report_employees": len(report_map),
+        "xml_wire_bytes": xml_sizes["wire_bytes"],
+        "xml_decoded_bytes": xml_sizes["decoded_bytes"],
+        "report_wire_bytes": report_sizes["wire_bytes"],
+        "report_decoded_bytes": report_sizes["decoded_bytes"],
+        "xml_best_ms": round(xml_seconds * 1000, 2),
+        "report_best_ms": round(report_seconds * 1000, 2),
+        "identity_mismatches": len(mismatched),
+        "identity_mismatch_sample": mismatched[:sync.LOG_SAMPLE_LIMIT],
+    }
+
+
+def synthetic_values(index):
+    return {
+        "firstName": f"First{index}",
+        "lastName": f"Last{index}",
+        "preferredName": "",
+        "displayName": f"First{index} Last{index}",
+        "workEmail": f"user{index}@example.com",
+        "department": "Operations",
+    }
+
+
+def build_directory_xml(count):
+    parts = ['<?xml version="1.0"?>', "<directory>", "<fieldset>"]
+    parts += [f'<field id="{field_id}">{field_id}</field>' for field_id in DIRECTORY_IDENTITY_FIELDS]
+    parts += ["</fieldset>", "<employees>"]
+    for index in range(count):
+        values = synthetic_values(index)
+        parts.append(f'<employee id="{index}">')
+        for field_id in DIRECTORY_IDENTITY_FIELDS:
+            parts.append(f'<field id="{field_id}">{escape(values[field_id])}</field>')
+        parts.append("</employee>")
+    parts += ["</employees>", "</directory>"]
+    return "".join(parts)
+
+
+def build_custom_report_json(count):
+    payload = {
+        "title": "Report",
+        "fields": [
+            {"id": field_id, "type": "text", "name": field_id}
+            for field_id in DIRECTORY_IDENTITY_FIELDS
+        ],
+        "employees": [dict(id=str(index), **synthetic_values(index)) for index in range(count)],
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def run_synthetic(count, repeats):
+    xml_body = build_directory_xml(count)
+    json_body = build_custom_report_json(count)
+    chunk = sync.REPORT_CHUNK_BYTES
+
+    xml_seconds, xml_map = best_of(repeats, lambda: sync.parse_directory_xml(xml_body))
+    report_seconds, report_map = best_of(
+        repeats,
+        lambda: sync.parse_custom_report(
+            json_body[i : i + chunk] for i in range(0, len(json_body), chunk)
+        ),
+    )
+
+    mismatched = identity_mismatches(xml_map, report_map)
+    return {
+        "mode": "synthetic_parse_only",
+        "employees": count,
+        "repeats": repeats,
+        "xml_parse_best_ms": round(xml_seconds * 1000, 2),
+        "report_parse_best_ms": round(report_seconds * 1000, 2),
+        "identity_mismatches": len(mismatched),
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    mode = args.pop(0) if args else ""
+    if mode == "live":
+        result = run_live(int(args[0]) if args else 3)
+    elif mode == "synthetic":
+        count = int(args[0]) if args else 5000
+        repeats = int(args[1]) if len(args) > 1 else 5
+        result = run_synthetic(count, repeats)
+    else:
+        raise SystemExit(__doc__)
+    print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
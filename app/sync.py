@@ -1,9 +1,13 @@
+import atexit
+import codecs
 import json
 import os
 import re
 import secrets
+import signal
 import string
 import sys
+import traceback
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta, timezone
 
@@ -12,6 +16,21 @@ import requests
 
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
+# Only the fields read by parse_directory_identity and is_inactive_bamboo_user.
+# homeEmail is deliberately excluded: the directory XML never returned it, and
+# using it would turn personal addresses into canonical Moodle usernames.
+BAMBOO_REPORT_FIELDS = [
+    "firstName",
+    "lastName",
+    "preferredName",
+    "displayName",
+    "workEmail",
+    "department",
+    "status",
+    "employmentHistoryStatus",
+]
+REPORT_CHUNK_BYTES = 64 * 1024
+
 
 def env_int(name, default):
     raw = os.getenv(name)
@@ -51,6 +70,9 @@ ENFORCE_AUTH_ON_UPDATE = str(os.getenv("ENFORCE_AUTH_ON_UPDATE", "true")).strip(
     "on",
 )
 MOODLE_USERNAME_SOURCE = str(os.getenv("MOODLE_USERNAME_SOURCE", "email")).strip().lower()
+BAMBOO_DIRECTORY_SOURCE = str(os.getenv("BAMBOO_DIRECTORY_SOURCE", "report")).strip().lower()
+LOG_FLUSH_EVENTS = env_int("LOG_FLUSH_EVENTS", 200)
+LOG_SAMPLE_LIMIT = env_int("LOG_SAMPLE_LIMIT", 5)
 
 DDB_TABLE = os.getenv("DDB_TABLE", "bamboohr-moodle-sync-state")
 STATE_ID = os.getenv("STATE_ID", "default")
@@ -66,6 +88,57 @@ def utc_now_iso():
     return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
+# Structured log sink. Events are buffered as JSON lines and written to stdout
+# in bulk; repetitive per-record events are counted and only the first
+# LOG_SAMPLE_LIMIT occurrences of each are emitted in full.
+_log_buffer = []
+_sampled_counts = {}
+_sampled_employee_ids = {}
+
+
+def flush_logs():
+    if not _log_buffer:
+        return
+    # Swap the buffer out first so a re-entrant flush (SIGTERM) cannot repeat lines.
+    lines = _log_buffer[:]
+    _log_buffer.clear()
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+
+def log_event(level, event, **fields):
+    entry = {"ts": utc_now_iso(), "level": level, "event": event}
+    entry.update(fields)
+    _log_buffer.append(json.dumps(entry, sort_keys=True, default=str))
+    if len(_log_buffer) >= max(1, LOG_FLUSH_EVENTS):
+        flush_logs()
+
+
+def log_sampled_event(level, event, employee_id, **fields):
+    count = _sampled_counts.get(event, 0) + 1
+    _sampled_counts[event] = count
+    if count > max(0, LOG_SAMPLE_LIMIT):
+        return
+    _sampled_employee_ids.setdefault(event, []).append(employee_id)
+    log_event(level, event, employee_id=employee_id, **fields)
+
+
+def handle_sigterm(signum, frame):
+    log_event("ERROR", "run_terminated", signal=signum)
+    flush_logs()
+    sys.exit(128 + signum)
+
+
+def sampled_event_summary():
+    return {
+        event: {
+            "count": count,
+            "sample_employee_ids": _sampled_employee_ids.get(event, []),
+        }
+        for event, count in sorted(_sampled_counts.items())
+    }
+
+
 def default_since_iso():
     ts = datetime.now(timezone.utc) - timedelta(days=max(0, INITIAL_LOOKBACK_DAYS))
     return ts.strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -158,9 +231,16 @@ def fetch_bamboo_changes(since, api_key):
     )
 
     content_type = resp.headers.get("content-type", "")
-    print("BAMBOO status:", resp.status_code, "content-type:", content_type)
-    head = (resp.text or "")[:300].replace("\n", " ")
-    print("BAMBOO body head:", head)
+    response_fields = {
+        "status": resp.status_code,
+        "content_type": content_type,
+        "bytes": len(resp.content or b""),
+    }
+    level = "INFO"
+    if resp.status_code >= 400:
+        level = "ERROR"
+        response_fields["body_head"] = (resp.text or "")[:300].replace("\n", " ")
+    log_event(level, "bamboo_changed_response", **response_fields)
 
     resp.raise_for_status()
     text = resp.text or ""
@@ -188,20 +268,14 @@ def fetch_bamboo_changes(since, api_key):
         latest = payload.get("latest") or payload.get("lastChanged") or since
         return {"employees": employees, "latest": str(latest)}
 
-    raise ValueError(f"Unexpected content-type from Bamboo changed endpoint: {content_type}")
-
-
-def bamboo_directory(api_key):
-    url = f"https://api.bamboohr.com/api/gateway.php/{BAMBOO_COMPANY_DOMAIN}/v1/employees/directory"
-    resp = requests.get(
-        url,
-        headers={"Accept": "application/xml"},
-        auth=(api_key, "x"),
-        timeout=HTTP_TIMEOUT_SECONDS,
+    head = text[:300].replace("\n", " ")
+    raise ValueError(
+        f"Unexpected content-type from Bamboo changed endpoint: {content_type} | body head: {head}"
     )
-    resp.raise_for_status()
 
-    root = ET.fromstring(resp.text or "")
+
+def parse_directory_xml(text):
+    root = ET.fromstring(text or "")
 
     fid_to_name = {}
     for field in root.findall(".//fieldset//field"):
@@ -229,6 +303,141 @@ def bamboo_directory(api_key):
     return directory_map
 
 
+def iter_report_employees(chunks):
+    # Incrementally walk the top-level report object and yield entries of its
+    # "employees" array one at a time, so the full body is never held at once.
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    exhausted = False
+
+    def fill():
+        nonlocal buf, pos, exhausted
+        if exhausted:
+            raise ValueError("Truncated Bamboo custom report response")
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            buf = buf[pos:] + text_decoder.decode(b"", final=True)
+        else:
+            if isinstance(chunk, bytes):
+                chunk = text_decoder.decode(chunk)
+            buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            fill()
+
+    def expect(chars):
+        nonlocal pos
+        char = skip_ws()
+        if char not in chars:
+            raise ValueError(f"Unexpected character in Bamboo custom report: {char!r}")
+        pos += 1
+        return char
+
+    def decode_value():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if exhausted:
+                    raise
+                fill()
+                continue
+            # A number at the end of the buffer may continue in the next chunk.
+            if end == len(buf) and not exhausted:
+                fill()
+                continue
+            pos = end
+            return value
+
+    expect("{")
+    if skip_ws() == "}":
+        return
+    while True:
+        key = decode_value()
+        expect(":")
+        if key == "employees" and skip_ws() == "[":
+            pos += 1
+            if skip_ws() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield decode_value()
+                    if expect(",]") == "]":
+                        break
+        else:
+            decode_value()
+        if expect(",}") == "}":
+            return
+
+
+def parse_custom_report(chunks):
+    directory_map = {}
+    for employee in iter_report_employees(chunks):
+        if not isinstance(employee, dict):
+            continue
+        employee_id = str(employee.get("id") or "").strip()
+        if not employee_id:
+            continue
+        directory_map[employee_id] = {
+            str(key).strip().lower(): str(value).strip() if value is not None else ""
+            for key, value in employee.items()
+            if key != "id"
+        }
+    return directory_map
+
+
+def bamboo_custom_report(api_key):
+    url = f"https://api.bamboohr.com/api/gateway.php/{BAMBOO_COMPANY_DOMAIN}/v1/reports/custom"
+    resp = requests.post(
+        url,
+        params={"format": "JSON", "onlyCurrent": "true"},
+        json={"fields": BAMBOO_REPORT_FIELDS},
+        headers={"Accept": "application/json"},
+        auth=(api_key, "x"),
+        timeout=HTTP_TIMEOUT_SECONDS,
+        stream=True,
+    )
+    with resp:
+        resp.raise_for_status()
+        return parse_custom_report(resp.iter_content(chunk_size=REPORT_CHUNK_BYTES))
+
+
+def bamboo_directory_xml(api_key):
+    url = f"https://api.bamboohr.com/api/gateway.php/{BAMBOO_COMPANY_DOMAIN}/v1/employees/directory"
+    resp = requests.get(
+        url,
+        headers={"Accept": "application/xml"},
+        auth=(api_key, "x"),
+        timeout=HTTP_TIMEOUT_SECONDS,
+    )
+    resp.raise_for_status()
+    return parse_directory_xml(resp.text)
+
+
+def bamboo_directory(api_key):
+    if BAMBOO_DIRECTORY_SOURCE == "report":
+        return bamboo_custom_report(api_key)
+    if BAMBOO_DIRECTORY_SOURCE == "directory":
+        return bamboo_directory_xml(api_key)
+    raise ValueError(
+        f"Unsupported BAMBOO_DIRECTORY_SOURCE: {BAMBOO_DIRECTORY_SOURCE!r} "
+        "(expected 'report' or 'directory')"
+    )
+
+
 def moodle_endpoint():
     return f"{MOODLE_BASE_URL.rstrip('/')}/webservice/rest/server.php"
 
@@ -414,21 +623,18 @@ def resolve_existing_moodle_user(moodle_token, employee_id, identity):
 
         matched_idnumber = str(candidate.get("idnumber") or "").strip()
         if matched_idnumber and matched_idnumber != employee_id:
-            print(
-                "WARN: quarantined identity drift on fallback lookup",
-                json.dumps(
-                    {
-                        "employee_id": employee_id,
-                        "match_source": match_source,
-                        "match_field": field,
-                        "match_value": value,
-                        "matched_user_id": candidate.get("id"),
-                        "matched_username": candidate.get("username"),
-                        "matched_idnumber": candidate.get("idnumber"),
-                        "expected_username": identity["username"],
-                        "legacy_username": identity["legacy_username"],
-                    }
-                ),
+            log_sampled_event(
+                "WARN",
+                "quarantined_identity_drift",
+                employee_id,
+                match_source=match_source,
+                match_field=field,
+                match_value=value,
+                matched_user_id=candidate.get("id"),
+                matched_username=candidate.get("username"),
+                matched_idnumber=candidate.get("idnumber"),
+                expected_username=identity["username"],
+                legacy_username=identity["legacy_username"],
             )
             return "quarantined_identity_drift"
         return candidate
@@ -447,19 +653,16 @@ def canonical_username_collision(moodle_token, employee_id, current_user_id, ide
     if int(username_user["id"]) == current_user_id:
         return None
 
-    print(
-        "WARN: quarantined canonical username collision",
-        json.dumps(
-            {
-                "employee_id": employee_id,
-                "current_user_id": current_user_id,
-                "canonical_username": identity["username"],
-                "collision_user_id": username_user.get("id"),
-                "collision_idnumber": username_user.get("idnumber"),
-                "collision_email": username_user.get("email"),
-                "legacy_username": identity["legacy_username"],
-            }
-        ),
+    log_sampled_event(
+        "WARN",
+        "quarantined_username_collision",
+        employee_id,
+        current_user_id=current_user_id,
+        canonical_username=identity["username"],
+        collision_user_id=username_user.get("id"),
+        collision_idnumber=username_user.get("idnumber"),
+        collision_email=username_user.get("email"),
+        legacy_username=identity["legacy_username"],
     )
     return "quarantined_identity_drift"
 
@@ -543,6 +746,8 @@ def process_moodle_record(record, directory_record, moodle_token):
 
 def main():
     started_at = utc_now_iso()
+    atexit.register(flush_logs)
+    signal.signal(signal.SIGTERM, handle_sigterm)
     errors = 0
 
     ddb = boto3.client("dynamodb")
@@ -565,11 +770,13 @@ def main():
     )
 
     if not bamboo_api_key:
-        print("ERROR: Bamboo API key not found in secret")
+        log_event("ERROR", "bamboo_api_key_missing")
+        flush_logs()
         sys.exit(1)
 
     if not moodle_token:
-        print("ERROR: Moodle token not found in secret")
+        log_event("ERROR", "moodle_token_missing")
+        flush_logs()
         sys.exit(1)
 
     state = get_state(ddb)
@@ -606,8 +813,10 @@ def main():
             batch = changes[offset:] if BATCH_SIZE <= 0 else changes[offset : offset + BATCH_SIZE]
 
             for record in batch:
+                employee_id = str(
+                    (record.get("id") if isinstance(record, dict) else None) or ""
+                ).strip()
                 try:
-                    employee_id = str(record.get("id") or "").strip()
                     directory_record = directory_map.get(employee_id, {})
                     outcome = process_moodle_record(record, directory_record, moodle_token)
 
@@ -629,9 +838,12 @@ def main():
                     elif outcome == "quarantined_identity_drift":
                         quarantined_identity_drift += 1
                 except Exception as record_error:
-                    print(
-                        "ERROR: record processing failed",
-                        json.dumps({"record": record, "error": repr(record_error)}),
+                    log_sampled_event(
+                        "ERROR",
+                        "record_processing_failed",
+                        employee_id,
+                        record=record,
+                        error=repr(record_error),
                     )
                     if SKIP_RECORD_ERRORS:
                         skipped_record_errors += 1
@@ -656,10 +868,12 @@ def main():
 
     except Exception as run_error:
         errors += 1
-        import traceback
-
-        print("ERROR: run failed", repr(run_error))
-        traceback.print_exc()
+        log_event(
+            "ERROR",
+            "run_failed",
+            error=repr(run_error),
+            traceback=traceback.format_exc(),
+        )
 
     summary = {
         "started_at": started_at,
@@ -680,9 +894,11 @@ def main():
         "latest": latest,
         "next_since": next_since,
         "next_offset": next_offset,
+        "sampled_events": sampled_event_summary(),
     }
 
-    print(json.dumps(summary, sort_keys=True))
+    log_event("INFO", "run_summary", **summary)
+    flush_logs()
     sys.exit(0 if errors == 0 else 1)
 
 